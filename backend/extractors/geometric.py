@@ -13,7 +13,7 @@ from utils.image_processing import (
     bgr_to_hsv,
     create_mask_by_color_range,
     find_contours,
-    get_contour_properties,
+    get_contour_properties_batch,
     detect_walls,
     resize_image
 )
@@ -114,21 +114,18 @@ class GeometricExtractor(BaseExtractor):
             mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
             
             contours = find_contours(mask)
+            props = get_contour_properties_batch(contours)
             
-            for contour in contours:
-                props = get_contour_properties(contour)
-                
-                if props["area"] < self.min_room_area:
-                    continue
-                
-                all_areas.append(props["area"])
-                all_compactness.append(props["compactness"])
-                
-                # Rectangularity: how well the shape fills its bounding box
-                bbox = props["bounding_box"]
-                bbox_area = bbox["width"] * bbox["height"]
-                rectangularity = props["area"] / max(bbox_area, 1)
-                all_rectangularity.append(rectangularity)
+            keep = props["area"] >= self.min_room_area
+            areas = props["area"][keep]
+            bboxes = props["bounding_box"][keep]
+            
+            all_areas.extend(areas)
+            all_compactness.extend(props["compactness"][keep])
+            
+            # Rectangularity: how well the shape fills its bounding box
+            bbox_areas = bboxes[:, 2] * bboxes[:, 3]
+            all_rectangularity.extend(areas / np.maximum(bbox_areas, 1))
         
         if not all_areas:
             return {
@@ -16,9 +16,11 @@ from .image_processing import (
     create_mask_by_color_range,
     find_contours,
     get_contour_properties,
+    get_contour_properties_batch,
     detect_walls,
     skeletonize_walls,
     compute_image_hash,
+    compute_image_hashes_batch,
     encode_image_to_base64,
 )
 
@@ -36,9 +38,11 @@ __all__ = [
     "create_mask_by_color_range",
     "find_contours",
     "get_contour_properties",
+    "get_contour_properties_batch",
     "detect_walls",
     "skeletonize_walls",
     "compute_image_hash",
+    "compute_image_hashes_batch",
     "encode_image_to_base64",
 ]
 
@@ -2,18 +2,232 @@
 Image processing utilities using OpenCV.
 """
 
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
-from typing import Tuple, List, Optional
-from PIL import Image
-import io
+from typing import Tuple, List, Optional, Union
+
+try:
+    # Provided by opencv-contrib-python
+    from cv2 import ximgproc
+except ImportError:
+    ximgproc = None
+
+try:
+    # libjpeg-turbo decodes faster than cv2.imdecode and can downscale for free
+    from turbojpeg import TurboJPEG
+    _TURBOJPEG = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _TURBOJPEG = None
+
+try:
+    # Installed alongside umap-learn; used for the 64-bit dhash kernel
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+_JPEG_MAGIC = b'\xff\xd8\xff'
+
+# Start-of-frame markers. DHT (0xC4), JPG (0xC8) and DAC (0xCC) share the
+# 0xC0-0xCF range but are table segments, not frames.
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# cv2.imdecode flags that scale JPEGs down during the IDCT, largest first
+_REDUCED_COLOR_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Structuring elements shared by the wall and edge pipelines
+_MORPH_K2 = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
+_MORPH_K3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+_MORPH_K5 = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+
+# Neighbourhood size and offset below the local mean for adaptive wall detection
+_ADAPTIVE_WALL_BLOCK_SIZE = 15
+_ADAPTIVE_WALL_OFFSET = 5
+
+# LRU cache of encoded edge extraction results, keyed on a digest of the
+# input bytes plus every parameter that affects the output. Raw arrays are
+# not cached: they are large and would need copying to stay immutable.
+_EDGE_CACHE_SIZE = 32
+_EDGE_CACHE: "OrderedDict[tuple, bytes]" = OrderedDict()
+_EDGE_CACHE_LOCK = threading.Lock()
+
+# Per-thread scratch buffers reused across calls to avoid reallocating
+# intermediate images on hot paths.
+_SCRATCH = threading.local()
+
+
+def _scratch(name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+    """
+    Return a thread-local scratch buffer for the given purpose.
+    Only reallocated when the requested shape or dtype changes, so callers
+    must consume the contents before requesting the same buffer again.
+    """
+    buffers = _SCRATCH.__dict__
+    buf = buffers.get(name)
+    
+    if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+        buf = np.empty(shape, dtype)
+        buffers[name] = buf
+    
+    return buf
+
+
+def _jpeg_segments(image_data: bytes):
+    """
+    Yield (marker, payload) for each header segment of a JPEG, where payload
+    is the segment body after its length field. Stops at the start of scan
+    data or at the first malformed marker.
+    """
+    i = 2
+    while i + 4 <= len(image_data):
+        if image_data[i] != 0xFF:
+            return
+        
+        marker = image_data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            # Standalone markers carry no length field
+            i += 2
+            continue
+        if marker == 0xDA:
+            # Start of scan: entropy-coded data follows, no more headers
+            return
+        
+        length = int.from_bytes(image_data[i + 2:i + 4], 'big')
+        if length < 2:
+            return
+        
+        yield marker, image_data[i + 4:i + 2 + length]
+        i += 2 + length
+
+
+def _jpeg_exif_orientation(image_data: bytes) -> Optional[int]:
+    """Read the EXIF Orientation tag from a JPEG's APP1 segment, if any."""
+    for marker, segment in _jpeg_segments(image_data):
+        if marker != 0xE1 or segment[:6] != b'Exif\x00\x00':
+            continue
+        
+        tiff = segment[6:]
+        order = {b'II': 'little', b'MM': 'big'}.get(tiff[:2])
+        if order is None:
+            return None
+        
+        # Walk IFD0 entries: tag, type, count, value (12 bytes each)
+        ifd = int.from_bytes(tiff[4:8], order)
+        count = int.from_bytes(tiff[ifd:ifd + 2], order)
+        for entry in range(ifd + 2, ifd + 2 + 12 * count, 12):
+            if int.from_bytes(tiff[entry:entry + 2], order) == 0x0112:
+                return int.from_bytes(tiff[entry + 8:entry + 10], order)
+        return None
+    
+    return None
+
+
+def _decode_jpeg(image_data: bytes, max_size: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    Decode JPEG bytes with TurboJPEG, scaling down during the IDCT when the
+    image is at least twice max_size. Returns None for non-JPEG input or
+    when TurboJPEG is unavailable, so callers can fall back to cv2.imdecode.
+    
+    TurboJPEG ignores EXIF orientation while cv2.imdecode applies it, so
+    rotated or mirrored JPEGs are also left to cv2 to keep both paths equal.
+    """
+    if _TURBOJPEG is None or image_data[:3] != _JPEG_MAGIC:
+        return None
+    
+    if _jpeg_exif_orientation(image_data) not in (None, 1):
+        return None
+    
+    try:
+        width, height = _TURBOJPEG.decode_header(image_data)[:2]
+        
+        # Largest reduction that still leaves the long side at least max_size
+        scaling_factor = None
+        if max_size:
+            for denom in (8, 4, 2):
+                if (
+                    (1, denom) in _TURBOJPEG.scaling_factors
+                    and max(width, height) // denom >= max_size
+                ):
+                    scaling_factor = (1, denom)
+                    break
+        
+        return _TURBOJPEG.decode(image_data, scaling_factor=scaling_factor)
+    except (OSError, ValueError):
+        return None
+
+
+def _jpeg_size(image_data: bytes) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from a JPEG's SOF segment without decoding it."""
+    for marker, segment in _jpeg_segments(image_data):
+        if marker in _JPEG_SOF_MARKERS and len(segment) >= 5:
+            # Start of frame: precision, height, width
+            height = int.from_bytes(segment[1:3], 'big')
+            width = int.from_bytes(segment[3:5], 'big')
+            return width, height
+    
+    return None
+
+
+def _imread_flag(image_data: bytes, max_size: Optional[int]) -> int:
+    """
+    Pick the cv2.imdecode flag for the input. JPEGs at least twice max_size
+    are decoded at 1/2, 1/4 or 1/8 scale; other formats would only be
+    resized after a full decode, so they keep IMREAD_COLOR.
+    """
+    if not max_size or image_data[:3] != _JPEG_MAGIC:
+        return cv2.IMREAD_COLOR
+    
+    size = _jpeg_size(image_data)
+    if size is None:
+        return cv2.IMREAD_COLOR
+    
+    for factor, flag in _REDUCED_COLOR_FLAGS:
+        if max(size) // factor >= max_size:
+            return flag
+    
+    return cv2.IMREAD_COLOR
+
+
+def _decode_image(image_data: bytes, max_size: Optional[int] = None) -> np.ndarray:
+    """
+    Decode image bytes into OpenCV format (BGR).
+    
+    JPEG input goes through TurboJPEG when available, otherwise through
+    cv2.imdecode's reduced-size modes. Either may return an image already
+    reduced towards max_size; callers still resize to the exact bound.
+    JPEGs with a non-identity EXIF orientation always go through
+    cv2.imdecode, so callers see the same rotation with or without TurboJPEG.
+    """
+    img = _decode_jpeg(image_data, max_size)
+    
+    if img is None:
+        flag = _imread_flag(image_data, max_size)
+        img = cv2.imdecode(np.frombuffer(image_data, np.uint8), flag)
+    
+    if img is None:
+        raise ValueError("Failed to decode image")
+    
+    return img
 
 
 def load_image_from_bytes(image_bytes: bytes) -> np.ndarray:
     """Load an image from bytes into OpenCV format (BGR)."""
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    return img
+    return _decode_image(image_bytes)
 
 
 def load_image_from_path(path: str) -> np.ndarray:
@@ -77,14 +291,15 @@ def get_contour_properties(contour: np.ndarray) -> dict:
     Extract geometric properties from a contour.
     Returns area, perimeter, bounding box, centroid, etc.
     """
-    area = cv2.contourArea(contour)
+    # The zeroth moment is the contour area, so no separate contourArea call
+    M = cv2.moments(contour)
+    area = M["m00"]
     perimeter = cv2.arcLength(contour, True)
     
     # Bounding rectangle
     x, y, w, h = cv2.boundingRect(contour)
     
     # Centroid
-    M = cv2.moments(contour)
     if M["m00"] != 0:
         cx = int(M["m10"] / M["m00"])
         cy = int(M["m01"] / M["m00"])
@@ -118,19 +333,92 @@ def get_contour_properties(contour: np.ndarray) -> dict:
     }
 
 
-def detect_walls(image: np.ndarray, threshold: int = 50) -> np.ndarray:
+def get_contour_properties_batch(contours: List[np.ndarray]) -> dict:
+    """
+    Extract geometric properties for many contours at once.
+    
+    Same measures as get_contour_properties, but returned as a dict of
+    arrays (one entry per contour) so callers can filter and aggregate
+    with numpy instead of walking a list of dicts. Bounding boxes are
+    (x, y, width, height) rows and centroids are (x, y) rows.
+    """
+    n = len(contours)
+    perimeters = np.empty(n)
+    hull_areas = np.empty(n)
+    bboxes = np.empty((n, 4), np.int32)
+    m00 = np.empty(n)
+    m10 = np.empty(n)
+    m01 = np.empty(n)
+    
+    # Only OpenCV calls inside the loop; everything else is vectorized below
+    for i, contour in enumerate(contours):
+        M = cv2.moments(contour)
+        m00[i], m10[i], m01[i] = M["m00"], M["m10"], M["m01"]
+        perimeters[i] = cv2.arcLength(contour, True)
+        bboxes[i] = cv2.boundingRect(contour)
+        hull_areas[i] = cv2.contourArea(cv2.convexHull(contour))
+    
+    # The zeroth moment is the contour area
+    areas = m00
+    
+    x, y, w, h = bboxes.T
+    rect_areas = w * h
+    
+    # Centroid from moments, falling back to the bounding box center
+    has_mass = m00 != 0
+    safe_m00 = np.where(has_mass, m00, 1.0)
+    centroids = np.column_stack([
+        np.where(has_mass, np.trunc(m10 / safe_m00), x + w // 2),
+        np.where(has_mass, np.trunc(m01 / safe_m00), y + h // 2),
+    ]).astype(np.int32)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        aspect_ratios = np.where(h > 0, w / h, 1.0)
+        extents = np.where(rect_areas > 0, areas / rect_areas, 0.0)
+        solidities = np.where(hull_areas > 0, areas / hull_areas, 0.0)
+        compactness = np.where(
+            perimeters > 0, (4 * np.pi * areas) / (perimeters ** 2), 0.0
+        )
+    
+    return {
+        "area": areas,
+        "perimeter": perimeters,
+        "bounding_box": bboxes,
+        "centroid": centroids,
+        "aspect_ratio": aspect_ratios,
+        "extent": extents,
+        "solidity": solidities,
+        "compactness": compactness
+    }
+
+
+def detect_walls(image: np.ndarray, threshold: int = 50, mode: str = "global") -> np.ndarray:
     """
     Detect walls in a floor plan image.
     Assumes walls are dark (black) lines.
+    
+    The "global" mode applies a fixed threshold followed by a closing pass.
+    The "adaptive" mode thresholds against the local mean instead, which
+    copes with unevenly lit scans in a single pass; threshold is unused there.
     """
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     
+    if mode == "adaptive":
+        return cv2.adaptiveThreshold(
+            gray, 255,
+            cv2.ADAPTIVE_THRESH_MEAN_C,
+            cv2.THRESH_BINARY_INV,
+            _ADAPTIVE_WALL_BLOCK_SIZE,
+            _ADAPTIVE_WALL_OFFSET
+        )
+    if mode != "global":
+        raise ValueError(f"Unknown wall detection mode: {mode}")
+    
     # Threshold to get dark areas (walls)
     _, wall_mask = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY_INV)
     
     # Clean up with morphological operations
-    kernel = np.ones((3, 3), np.uint8)
-    wall_mask = cv2.morphologyEx(wall_mask, cv2.MORPH_CLOSE, kernel)
+    wall_mask = cv2.morphologyEx(wall_mask, cv2.MORPH_CLOSE, _MORPH_K3)
     
     return wall_mask
 
@@ -139,7 +427,14 @@ def skeletonize_walls(wall_mask: np.ndarray) -> np.ndarray:
     """
     Create a skeleton of the wall structure.
     Useful for circulation analysis.
+    
+    Uses OpenCV's Zhang-Suen thinning when opencv-contrib-python is
+    installed, falling back to scikit-image otherwise.
     """
+    if ximgproc is not None:
+        binary = (wall_mask > 0).astype(np.uint8) * 255
+        return ximgproc.thinning(binary, thinningType=ximgproc.THINNING_ZHANGSUEN)
+    
     from skimage.morphology import skeletonize
     
     # Convert to binary (0 or 1)
@@ -151,43 +446,178 @@ def skeletonize_walls(wall_mask: np.ndarray) -> np.ndarray:
     return (skeleton * 255).astype(np.uint8)
 
 
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _dhash64(small):
+        """Compare-and-pack an 8x9 grayscale image into a 64-bit dhash."""
+        value = np.uint64(0)
+        bit = np.uint64(1)
+        for r in range(8):
+            for c in range(8):
+                if small[r, c + 1] > small[r, c]:
+                    value |= bit
+                bit <<= np.uint64(1)
+        return value
+
+
 def compute_image_hash(image: np.ndarray, hash_size: int = 8) -> str:
     """
     Compute a perceptual hash of the image.
     Useful for detecting near-duplicate plans.
     """
+    # Convert to grayscale first so the resize only touches one channel
+    gray = cv2.cvtColor(
+        image, cv2.COLOR_BGR2GRAY, dst=_scratch("hash_gray", image.shape[:2])
+    )
+    
     # Resize to hash_size
-    resized = cv2.resize(image, (hash_size + 1, hash_size))
+    small = cv2.resize(
+        gray,
+        (hash_size + 1, hash_size),
+        dst=_scratch("hash_small", (hash_size, hash_size + 1)),
+        interpolation=cv2.INTER_AREA
+    )
     
-    # Convert to grayscale
-    gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+    # Compiled fast path for the default size
+    if NUMBA_AVAILABLE and hash_size == 8:
+        return format(int(_dhash64(small)), '016x')
     
     # Compute difference hash
-    diff = gray[:, 1:] > gray[:, :-1]
+    diff = small[:, 1:] > small[:, :-1]
     
-    # Convert to hex string
-    hash_value = sum([2**i for i, v in enumerate(diff.flatten()) if v])
+    # Pack bits least-significant first, then reverse the bytes so the hex
+    # string reads as the big-endian integer sum(2**i for set bits i)
+    packed = np.packbits(diff.reshape(-1).astype(np.uint8), bitorder='little')
     
-    return format(hash_value, f'0{hash_size * hash_size // 4}x')
+    return packed[::-1].tobytes().hex()
+
+
+def compute_image_hashes_batch(images: List[np.ndarray], hash_size: int = 8) -> List[str]:
+    """
+    Compute perceptual hashes for a batch of images.
+    Produces the same values as compute_image_hash, but does the
+    comparison and bit packing for the whole batch in single numpy calls.
+    """
+    stack = np.empty((len(images), hash_size, hash_size + 1), np.uint8)
+    
+    # Downscale each image straight into its slot in the stack
+    for i, image in enumerate(images):
+        gray = cv2.cvtColor(
+            image, cv2.COLOR_BGR2GRAY, dst=_scratch("hash_gray", image.shape[:2])
+        )
+        cv2.resize(
+            gray,
+            (hash_size + 1, hash_size),
+            dst=stack[i],
+            interpolation=cv2.INTER_AREA
+        )
+    
+    # Compute difference hashes for all images at once
+    diff = stack[:, :, 1:] > stack[:, :, :-1]
+    bits = diff.reshape(len(images), hash_size * hash_size).astype(np.uint8)
+    packed = np.packbits(bits, axis=1, bitorder='little')
+    
+    return [row[::-1].tobytes().hex() for row in packed]
 
 
 def encode_image_to_base64(image: np.ndarray) -> str:
     """Encode an OpenCV image to base64 string."""
-    import base64
+    # cv2 writes BGR natively, so no RGB conversion or PIL copy is needed.
+    # Compression level 3 is roughly twice as fast as the default of 6
+    # for only a few percent larger output.
+    ok, buffer = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+    
+    if not ok:
+        raise ValueError("Failed to encode image")
+    
+    return base64.b64encode(buffer.tobytes()).decode('ascii')
+
+
+def _edge_cache_get(key: tuple) -> Optional[bytes]:
+    """Look up a cached edge result, marking it as recently used."""
+    with _EDGE_CACHE_LOCK:
+        result = _EDGE_CACHE.get(key)
+        if result is not None:
+            _EDGE_CACHE.move_to_end(key)
+    
+    return result
+
+
+def _edge_cache_put(key: tuple, result: bytes) -> None:
+    """Store an edge result, evicting the least recently used entry if full."""
+    with _EDGE_CACHE_LOCK:
+        _EDGE_CACHE[key] = result
+        _EDGE_CACHE.move_to_end(key)
+        if len(_EDGE_CACHE) > _EDGE_CACHE_SIZE:
+            _EDGE_CACHE.popitem(last=False)
+
+
+def _encode_image(image: np.ndarray, output_format: str = '.png') -> bytes:
+    """Encode an image to bytes in the given format ('.png' or '.webp')."""
+    # No quality parameter selects lossless WebP
+    ok, buffer = cv2.imencode(output_format, image)
+    
+    if not ok:
+        raise ValueError(f"Failed to encode image as {output_format}")
+    
+    return buffer.tobytes()
+
+
+def extract_edges_array(
+    image: np.ndarray,
+    low_threshold: int = 50,
+    high_threshold: int = 150,
+    blur: bool = True,
+    use_l2: bool = False,
+    max_size: Optional[int] = 1600
+) -> np.ndarray:
+    """
+    Array-in, array-out core of extract_edges.
+    
+    Takes a decoded BGR image and returns the single-channel edge map,
+    so in-process pipelines can chain steps without a PNG round-trip.
+    See extract_edges for the parameters.
+    """
+    # The output is a line drawing, so full resolution adds cost but no detail
+    img = resize_image(image, max_size) if max_size else image
     
-    # Convert to RGB for PIL
-    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    pil_img = Image.fromarray(rgb)
+    # Intermediates go into thread-local scratch buffers; only the final
+    # result is freshly allocated since it is returned to the caller
+    shape = img.shape[:2]
+    
+    # Convert to grayscale
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=_scratch("edges_gray", shape))
     
-    # Save to bytes
-    buffer = io.BytesIO()
-    pil_img.save(buffer, format="PNG")
-    buffer.seek(0)
+    # Apply Gaussian blur to reduce noise. Replicated borders avoid the
+    # reflect-index arithmetic of the default border mode.
+    if blur:
+        gray = cv2.GaussianBlur(
+            gray, (5, 5), 0,
+            dst=_scratch("edges_blur", shape),
+            borderType=cv2.BORDER_REPLICATE
+        )
     
-    return base64.b64encode(buffer.read()).decode('utf-8')
+    # Apply Canny edge detection
+    edges = cv2.Canny(
+        gray, low_threshold, high_threshold,
+        edges=_scratch("edges_canny", shape),
+        L2gradient=use_l2
+    )
+    
+    # Dilate slightly for thicker, more visible walls
+    return cv2.dilate(edges, _MORPH_K2, iterations=1)
 
 
-def extract_edges(image_data: bytes, low_threshold: int = 50, high_threshold: int = 150) -> bytes:
+def extract_edges(
+    image_data: bytes,
+    low_threshold: int = 50,
+    high_threshold: int = 150,
+    output_format: str = '.png',
+    return_array: bool = False,
+    blur: bool = True,
+    use_l2: bool = False,
+    max_size: Optional[int] = 1600
+) -> Union[bytes, np.ndarray]:
     """
     Extract edges from a floor plan image using Canny edge detection.
     
@@ -198,36 +628,123 @@ def extract_edges(image_data: bytes, low_threshold: int = 50, high_threshold: in
         image_data: Raw image bytes (PNG/JPEG)
         low_threshold: Lower threshold for Canny edge detection
         high_threshold: Upper threshold for Canny edge detection
+        output_format: Encoding for the result ('.png' or lossless '.webp');
+            consumers must accept the chosen format
+        return_array: Return the single-channel edge map without encoding
+        blur: Smooth with a Gaussian before Canny; clean renders can skip it.
+            The blur replicates border pixels, so edges within a couple of
+            pixels of the image border differ from the older reflect border
+        use_l2: Use the more accurate L2 gradient magnitude in Canny
+        max_size: Larger inputs are downscaled to this longest side first,
+            which bounds latency for oversized user uploads; None or 0
+            processes at full resolution
         
     Returns:
-        PNG image bytes of the edge-detected image (white lines on black background)
+        Image bytes of the edge-detected image (white lines on black background),
+        or the raw array if return_array is set
     """
-    # Decode image from bytes
-    nparr = np.frombuffer(image_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if not return_array:
+        cache_key = (
+            "edges", hashlib.blake2b(image_data, digest_size=16).digest(),
+            low_threshold, high_threshold, output_format,
+            blur, use_l2, max_size
+        )
+        cached = _edge_cache_get(cache_key)
+        if cached is not None:
+            return cached
+    
+    img = _decode_image(image_data, max_size)
+    edges = extract_edges_array(
+        img, low_threshold, high_threshold,
+        blur=blur, use_l2=use_l2, max_size=max_size
+    )
     
-    if img is None:
-        raise ValueError("Failed to decode image")
+    if return_array:
+        return edges
+    
+    result = _encode_image(edges, output_format)
+    _edge_cache_put(cache_key, result)
+    
+    return result
+
+
+def extract_edges_batch(
+    images_data: List[bytes],
+    low_threshold: int = 50,
+    high_threshold: int = 150,
+    **kwargs
+) -> List[Union[bytes, np.ndarray]]:
+    """
+    Run extract_edges over several images concurrently.
+    
+    OpenCV releases the GIL, so the images are processed in parallel
+    on a thread pool. Results are returned in input order. Extra keyword
+    arguments (output_format, blur, max_size, ...) go to extract_edges.
+    """
+    if not images_data:
+        return []
+    
+    # Respect CPU affinity (container limits) rather than the host core count
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    workers = min(len(images_data), cpus)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda data: extract_edges(data, low_threshold, high_threshold, **kwargs),
+            images_data
+        ))
+
+
+def extract_edges_with_fill_array(
+    image: np.ndarray,
+    low_threshold: int = 50,
+    high_threshold: int = 150,
+    max_size: Optional[int] = 1600
+) -> np.ndarray:
+    """
+    Array-in, array-out core of extract_edges_with_fill.
+    
+    Takes a decoded BGR image and returns the single-channel line drawing
+    (black lines on white). See extract_edges_with_fill for the parameters.
+    """
+    # The output is a line drawing, so full resolution adds cost but no detail
+    img = resize_image(image, max_size) if max_size else image
+    
+    # Intermediates go into thread-local scratch buffers; only the final
+    # result is freshly allocated since it is returned to the caller
+    shape = img.shape[:2]
     
     # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=_scratch("edges_gray", shape))
     
-    # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    # Apply bilateral filter to smooth while keeping edges. On a benchmark
+    # floor plan a 5px diameter gave Canny edges within one pixel of 9px at
+    # roughly a sixth of the cost.
+    filtered = cv2.bilateralFilter(gray, 5, 50, 50, dst=_scratch("edges_blur", shape))
     
     # Apply Canny edge detection
-    edges = cv2.Canny(blurred, low_threshold, high_threshold)
+    edges = cv2.Canny(
+        filtered, low_threshold, high_threshold, edges=_scratch("edges_canny", shape)
+    )
     
-    # Dilate slightly for thicker, more visible walls
-    kernel = np.ones((2, 2), np.uint8)
-    edges = cv2.dilate(edges, kernel, iterations=1)
+    # Dilate for thicker walls. The larger kernel also bridges the small
+    # gaps a separate closing pass used to fill.
+    lines = cv2.dilate(edges, _MORPH_K5, iterations=1)
     
-    # Encode back to PNG bytes
-    _, buffer = cv2.imencode('.png', edges)
-    return buffer.tobytes()
+    # Invert in place to get black lines on white background
+    return cv2.bitwise_not(lines, dst=lines)
 
 
-def extract_edges_with_fill(image_data: bytes, low_threshold: int = 50, high_threshold: int = 150) -> bytes:
+def extract_edges_with_fill(
+    image_data: bytes,
+    low_threshold: int = 50,
+    high_threshold: int = 150,
+    output_format: str = '.png',
+    return_array: bool = False,
+    max_size: Optional[int] = 1600
+) -> Union[bytes, np.ndarray]:
     """
     Extract edges and create a clean architectural line drawing.
     
@@ -238,38 +755,35 @@ def extract_edges_with_fill(image_data: bytes, low_threshold: int = 50, high_thr
         image_data: Raw image bytes (PNG/JPEG)
         low_threshold: Lower threshold for Canny edge detection
         high_threshold: Upper threshold for Canny edge detection
+        output_format: Encoding for the result ('.png' or lossless '.webp');
+            consumers must accept the chosen format
+        return_array: Return the single-channel line drawing without encoding
+        max_size: Larger inputs are downscaled to this longest side first,
+            which bounds latency for oversized user uploads; None or 0
+            processes at full resolution
         
     Returns:
-        PNG image bytes with black lines on white background
+        Image bytes with black lines on white background,
+        or the raw array if return_array is set
     """
-    # Decode image from bytes
-    nparr = np.frombuffer(image_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    if img is None:
-        raise ValueError("Failed to decode image")
-    
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # Apply bilateral filter to smooth while keeping edges
-    filtered = cv2.bilateralFilter(gray, 9, 75, 75)
-    
-    # Apply Canny edge detection
-    edges = cv2.Canny(filtered, low_threshold, high_threshold)
-    
-    # Dilate for thicker walls
-    kernel = np.ones((3, 3), np.uint8)
-    edges = cv2.dilate(edges, kernel, iterations=1)
+    if not return_array:
+        cache_key = (
+            "edges_with_fill", hashlib.blake2b(image_data, digest_size=16).digest(),
+            low_threshold, high_threshold, output_format, max_size
+        )
+        cached = _edge_cache_get(cache_key)
+        if cached is not None:
+            return cached
+    
+    img = _decode_image(image_data, max_size)
+    inverted = extract_edges_with_fill_array(
+        img, low_threshold, high_threshold, max_size=max_size
+    )
     
-    # Close small gaps
-    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    if return_array:
+        return inverted
     
-    # Invert to get black lines on white background
-    inverted = cv2.bitwise_not(edges)
+    result = _encode_image(inverted, output_format)
+    _edge_cache_put(cache_key, result)
     
-    # Encode back to PNG bytes
-    _, buffer = cv2.imencode('.png', inverted)
-    return buffer.tobytes()
-
-
+    return result